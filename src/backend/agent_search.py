@@ -1,15 +1,27 @@
 # This code is messy, this was originally an experiment
 import asyncio
-from typing import AsyncIterator
+from typing import AsyncIterator, Awaitable
 
 from fastapi import HTTPException
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.chat import rephrase_query_with_history
 from backend.constants import get_model_string
-from backend.db.chat import save_turn_to_db
-from backend.llm.base import BaseLLM, EveryLLM
+from backend.context_builder import (
+    ANSWER_CONTEXT_TOKENS,
+    STEP_CONTEXT_TOKENS,
+    count_tokens,
+    pack_search_results,
+    prompt_budget,
+)
+from backend.db.writer import persist_turn
+from backend.llm.base import (
+    QUERY_PLAN_CACHE_TTL,
+    SEARCH_QUERIES_CACHE_TTL,
+    BaseLLM,
+    get_llm,
+)
 from backend.prompts import CHAT_PROMPT, QUERY_PLAN_PROMPT, SEARCH_QUERY_PROMPT
 from backend.related_queries import generate_related_queries
 from backend.schemas import (
@@ -32,8 +44,10 @@ from backend.schemas import (
     StreamEvent,
     TextChunkStream,
 )
+from backend.search.dedup import dedupe_search_results
+from backend.search.rerank import rerank_search_results
 from backend.search.search_service import perform_search
-from backend.utils import PRO_MODE_ENABLED, is_local_model
+from backend.utils import PRO_MODE_ENABLED, PRO_SEARCH_SPECULATIVE, is_local_model
 
 
 class QueryPlanStep(BaseModel):
@@ -85,217 +99,374 @@ async def ranked_search_results_and_images_from_queries(
     ranked_results: list[SearchResult] = [
         result for results in zip(*all_search_results) for result in results if result
     ]
-    unique_results = list({result.url: result for result in ranked_results}.values())
+    unique_results = dedupe_search_results(ranked_results)
+    unique_results = rerank_search_results(" ".join(queries), unique_results)
 
     images = list({image: image for images in all_images for image in images}.values())
     return unique_results, images
 
 
-def build_context_from_search_results(search_results: list[SearchResult]) -> str:
-    context = "\n".join(str(result) for result in search_results)
-    return context[:7000]
+def build_context_from_search_results(
+    search_results: list[SearchResult],
+    model: str,
+    max_tokens: int = STEP_CONTEXT_TOKENS,
+) -> str:
+    _, context = pack_search_results(
+        search_results, model=model, max_tokens=max_tokens, separator="\n"
+    )
+    return context
 
 
 def format_context_with_steps(
     search_results_map: dict[int, list[SearchResult]],
     step_contexts: dict[int, StepContext],
+    model: str,
+    max_tokens: int,
 ) -> str:
-    context = "\n".join(
-        f"Everything below is context for step: {step_contexts[step_id].step}\nContext: {build_context_from_search_results(search_results_map[step_id])}\n{'-'*20}\n"
-        for step_id in sorted(step_contexts.keys())
+    # Split the budget evenly across steps, a step's unused share goes to the next
+    step_ids = sorted(step_contexts.keys())
+    remaining = max_tokens
+    sections = []
+    for i, step_id in enumerate(step_ids):
+        header = f"Everything below is context for step: {step_contexts[step_id].step}\nContext: "
+        footer = f"\n{'-'*20}\n"
+        step_budget = remaining // (len(step_ids) - i) - count_tokens(
+            model, header + footer
+        )
+        context = build_context_from_search_results(
+            search_results_map[step_id], model, max(step_budget, 0)
+        )
+        if not context:
+            continue
+        section = header + context + footer
+        remaining -= count_tokens(model, section)
+        sections.append(section)
+    return "\n".join(sections)
+
+
+class QueryPlanState(BaseModel):
+    """Everything the executed steps produced, keyed by step id."""
+
+    step_context: dict[int, StepContext] = Field(default_factory=dict)
+    search_result_map: dict[int, list[SearchResult]] = Field(default_factory=dict)
+    image_map: dict[int, list[str]] = Field(default_factory=dict)
+    agent_search_steps: dict[int, AgentSearchStep] = Field(default_factory=dict)
+
+
+class StepFinished(BaseModel):
+    step_id: int
+
+
+async def execute_step(
+    step: QueryPlanStep,
+    llm: BaseLLM,
+    query: str,
+    state: QueryPlanState,
+    events: asyncio.Queue[ChatResponseEvent | StepFinished | Exception],
+    prefetched: Awaitable[tuple[list[SearchResult], list[str]]] | None = None,
+):
+    step_id = step.id
+    relevant_context = [
+        state.step_context[id] for id in step.dependencies if id in state.step_context
+    ]
+
+    if prefetched is not None:
+        # The user's query was already searched for this step
+        search_queries = [query]
+    else:
+        search_prompt = SEARCH_QUERY_PROMPT.format(
+            user_query=query,
+            current_step=step.step,
+            prev_steps_context=format_step_context(relevant_context),
+        )
+        query_step_execution = await llm.astructured_complete(
+            response_model=QueryStepExecution,
+            prompt=search_prompt,
+            cache_ttl=SEARCH_QUERIES_CACHE_TTL,
+        )
+        search_queries = query_step_execution.search_queries
+        if not search_queries:
+            raise HTTPException(
+                status_code=500,
+                detail="There was an error generating the search queries",
+            )
+
+    await events.put(
+        ChatResponseEvent(
+            event=StreamEvent.AGENT_SEARCH_QUERIES,
+            data=AgentSearchQueriesStream(queries=search_queries, step_number=step_id),
+        )
     )
-    context = context[:10000]
-    return context
 
+    if prefetched is None:
+        prefetched = ranked_search_results_and_images_from_queries(search_queries)
+    search_results, image_results = await prefetched
+    state.search_result_map[step_id] = search_results
+    state.image_map[step_id] = image_results
+
+    await events.put(
+        ChatResponseEvent(
+            event=StreamEvent.AGENT_READ_RESULTS,
+            data=AgentReadResultsStream(results=search_results, step_number=step_id),
+        )
+    )
+    context = build_context_from_search_results(search_results, llm.model)
+    state.step_context[step_id] = StepContext(step=step.step, context=context)
+
+    state.agent_search_steps[step_id] = AgentSearchStep(
+        step_number=step_id,
+        step=step.step,
+        queries=search_queries,
+        results=search_results,
+        status=AgentSearchStepStatus.DONE,
+    )
 
-async def stream_pro_search_objects(
-    request: ChatRequest, llm: BaseLLM, query: str, session: Session
+
+async def execute_query_plan(
+    steps: list[QueryPlanStep],
+    llm: BaseLLM,
+    query: str,
+    state: QueryPlanState,
+    prefetched: dict[int, asyncio.Task] | None = None,
 ) -> AsyncIterator[ChatResponseEvent]:
-    query_plan_prompt = QUERY_PLAN_PROMPT.format(query=query)
-    query_plan = llm.structured_complete(
-        response_model=QueryPlan, prompt=query_plan_prompt
+    """Run the search steps as a DAG, yielding their events as they happen.
+
+    Every step whose dependencies are done starts right away, so independent
+    steps generate their queries and search concurrently. Dependencies on ids
+    outside `steps` are ignored. If the remaining steps can never become ready
+    (a dependency cycle), they're started with whatever context exists.
+
+    `prefetched` maps step ids to searches that already started, those steps
+    use their results instead of generating search queries.
+    """
+    prefetched = prefetched or {}
+    step_ids = {step.id for step in steps}
+    pending = {step.id: step for step in steps}
+    running: set[asyncio.Task] = set()
+    finished: set[int] = set()
+    events: asyncio.Queue[ChatResponseEvent | StepFinished | Exception] = (
+        asyncio.Queue()
     )
-    print(query_plan)
 
-    yield ChatResponseEvent(
-        event=StreamEvent.AGENT_QUERY_PLAN,
-        data=AgentQueryPlanStream(steps=[step.step for step in query_plan.steps]),
-    )
+    async def run_step(step: QueryPlanStep):
+        try:
+            await execute_step(step, llm, query, state, events, prefetched.get(step.id))
+            await events.put(StepFinished(step_id=step.id))
+        except Exception as e:
+            await events.put(e)
 
-    step_context: dict[int, StepContext] = {}
-    search_result_map: dict[int, list[SearchResult]] = {}
-    image_map: dict[int, list[str]] = {}
-    agent_search_steps: list[AgentSearchStep] = []
+    try:
+        while len(finished) < len(step_ids):
+            ready = [
+                step
+                for step in pending.values()
+                if all(id in finished or id not in step_ids for id in step.dependencies)
+            ]
+            # Nothing in flight and nothing ready means the rest wait on each other
+            if not ready and len(pending) == len(step_ids) - len(finished):
+                ready = list(pending.values())
+            for step in ready:
+                del pending[step.id]
+                task = asyncio.create_task(run_step(step))
+                task.add_done_callback(running.discard)
+                running.add(task)
+
+            event = await events.get()
+            if isinstance(event, Exception):
+                raise event
+            if isinstance(event, StepFinished):
+                finished.add(event.step_id)
+                continue
+            yield event
+    finally:
+        for task in [*running, *prefetched.values()]:
+            task.cancel()
 
-    for idx, step in enumerate(query_plan.steps):
-        step_id = step.id
-        is_last_step = idx == len(query_plan.steps) - 1
-        dependencies = step.dependencies
 
-        relevant_context = [step_context[id] for id in dependencies]
+async def stream_pro_search_objects(
+    request: ChatRequest, llm: BaseLLM, query: str, session: AsyncSession
+) -> AsyncIterator[ChatResponseEvent]:
+    speculative_search = None
+    if PRO_SEARCH_SPECULATIVE:
+        # Search the query itself while the plan is generated, the first step
+        # uses these results instead of waiting on its own search queries
+        speculative_search = asyncio.create_task(
+            ranked_search_results_and_images_from_queries([query])
+        )
 
-        if not is_last_step:
-            search_prompt = SEARCH_QUERY_PROMPT.format(
-                user_query=query,
-                current_step=step.step,
-                prev_steps_context=format_step_context(relevant_context),
-            )
-            query_step_execution = llm.structured_complete(
-                response_model=QueryStepExecution, prompt=search_prompt
-            )
-            search_queries = query_step_execution.search_queries
-            if not search_queries:
-                raise HTTPException(
-                    status_code=500,
-                    detail="There was an error generating the search queries",
-                )
-
-            yield ChatResponseEvent(
-                event=StreamEvent.AGENT_SEARCH_QUERIES,
-                data=AgentSearchQueriesStream(
-                    queries=search_queries, step_number=step_id
-                ),
+    query_plan_prompt = QUERY_PLAN_PROMPT.format(query=query)
+    state = QueryPlanState()
+    # Once handed to the scheduler, the prefetch is cancelled by it
+    handed_off = False
+    try:
+        query_plan = await llm.astructured_complete(
+            response_model=QueryPlan,
+            prompt=query_plan_prompt,
+            cache_ttl=QUERY_PLAN_CACHE_TTL,
+        )
+        print(query_plan)
+        if not query_plan.steps:
+            raise HTTPException(
+                status_code=500,
+                detail="There was an error generating the query plan",
             )
 
-            (
-                search_results,
-                image_results,
-            ) = await ranked_search_results_and_images_from_queries(search_queries)
-            search_result_map[step_id] = search_results
-            image_map[step_id] = image_results
-
-            yield ChatResponseEvent(
-                event=StreamEvent.AGENT_READ_RESULTS,
-                data=AgentReadResultsStream(
-                    results=search_results, step_number=step_id
-                ),
-            )
-            context = build_context_from_search_results(search_results)
-            step_context[step_id] = StepContext(step=step.step, context=context)
-
-            agent_search_steps.append(
-                AgentSearchStep(
-                    step_number=step_id,
-                    step=step.step,
-                    queries=search_queries,
-                    results=search_results,
-                    status=AgentSearchStepStatus.DONE,
-                )
-            )
-        else:
-            yield ChatResponseEvent(
-                event=StreamEvent.AGENT_FINISH,
-                data=AgentFinishStream(),
-            )
+        yield ChatResponseEvent(
+            event=StreamEvent.AGENT_QUERY_PLAN,
+            data=AgentQueryPlanStream(steps=[step.step for step in query_plan.steps]),
+        )
+
+        # The last step answers the query from the results of the others
+        *search_steps, step = query_plan.steps
+
+        # Only a first step that doesn't wait on other steps can use the prefetch
+        prefetched: dict[int, asyncio.Task] = {}
+        search_step_ids = {search_step.id for search_step in search_steps}
+        if (
+            speculative_search
+            and search_steps
+            and search_step_ids.isdisjoint(search_steps[0].dependencies)
+        ):
+            prefetched[search_steps[0].id] = speculative_search
+            handed_off = True
+
+        async for event in execute_query_plan(
+            search_steps, llm, query, state, prefetched
+        ):
+            yield event
+    finally:
+        if speculative_search and not handed_off:
+            speculative_search.cancel()
 
-            yield ChatResponseEvent(
-                event=StreamEvent.BEGIN_STREAM,
-                data=BeginStream(query=query),
-            )
+    step_id = step.id
+    search_result_map = state.search_result_map
+    image_map = state.image_map
+    dependencies = [id for id in step.dependencies if id in search_result_map]
+    if not dependencies:
+        dependencies = list(search_result_map)
 
-            # Get 12 results total, but distribute them evenly across dependencies
-            relevant_result_map: dict[int, list[SearchResult]] = {
-                id: search_result_map[id] for id in dependencies
-            }
-            DESIRED_RESULT_COUNT = 12
-            total_results = sum(
-                len(results) for results in relevant_result_map.values()
-            )
-            results_per_dependency = min(
-                DESIRED_RESULT_COUNT // len(dependencies),
-                total_results // len(dependencies),
-            )
-            for id in dependencies:
-                relevant_result_map[id] = search_result_map[id][:results_per_dependency]
+    yield ChatResponseEvent(
+        event=StreamEvent.AGENT_FINISH,
+        data=AgentFinishStream(),
+    )
 
-            search_results = [
-                result for results in relevant_result_map.values() for result in results
-            ]
+    yield ChatResponseEvent(
+        event=StreamEvent.BEGIN_STREAM,
+        data=BeginStream(query=query),
+    )
 
-            # Remove duplicates
-            search_results = list(
-                {result.url: result for result in search_results}.values()
-            )
-            images = [image for id in dependencies for image in image_map[id][:2]]
-
-            related_queries_task = None
-            if not is_local_model(request.model):
-                related_queries_task = asyncio.create_task(
-                    generate_related_queries(query, search_results, llm)
-                )
-
-            yield ChatResponseEvent(
-                event=StreamEvent.SEARCH_RESULTS,
-                data=SearchResultStream(
-                    results=search_results,
-                    images=images,
-                ),
-            )
+    # Get 12 results total, but distribute them evenly across dependencies
+    relevant_result_map: dict[int, list[SearchResult]] = {
+        id: search_result_map[id] for id in dependencies
+    }
+    DESIRED_RESULT_COUNT = 12
+    total_results = sum(len(results) for results in relevant_result_map.values())
+    results_per_dependency = min(
+        DESIRED_RESULT_COUNT // max(len(dependencies), 1),
+        total_results // max(len(dependencies), 1),
+    )
+    for id in dependencies:
+        relevant_result_map[id] = search_result_map[id][:results_per_dependency]
 
-            fmt_qa_prompt = CHAT_PROMPT.format(
-                my_context=format_context_with_steps(search_result_map, step_context),
-                my_query=query,
-            )
+    search_results = [
+        result for results in relevant_result_map.values() for result in results
+    ]
 
-            full_response = ""
-            response_gen = await llm.astream(fmt_qa_prompt)
-            async for completion in response_gen:
-                full_response += completion.delta or ""
-                yield ChatResponseEvent(
-                    event=StreamEvent.TEXT_CHUNK,
-                    data=TextChunkStream(text=completion.delta or ""),
-                )
-
-            related_queries = await (
-                related_queries_task
-                if related_queries_task
-                else generate_related_queries(query, search_results, llm)
-            )
+    # Remove duplicates
+    search_results = dedupe_search_results(search_results)
+    search_results = rerank_search_results(query, search_results)
+    images = [image for id in dependencies for image in image_map[id][:2]]
 
-            yield ChatResponseEvent(
-                event=StreamEvent.RELATED_QUERIES,
-                data=RelatedQueriesStream(related_queries=related_queries),
-            )
+    related_queries_task = None
+    if not is_local_model(request.model):
+        related_queries_task = asyncio.create_task(
+            generate_related_queries(query, search_results, llm)
+        )
 
-            yield ChatResponseEvent(
-                event=StreamEvent.FINAL_RESPONSE,
-                data=FinalResponseStream(message=full_response),
-            )
+    yield ChatResponseEvent(
+        event=StreamEvent.SEARCH_RESULTS,
+        data=SearchResultStream(
+            results=search_results,
+            images=images,
+        ),
+    )
 
-            agent_search_steps.append(
-                AgentSearchStep(
-                    step_number=step_id,
-                    step=step.step,
-                    queries=[],
-                    results=[],
-                    status=AgentSearchStepStatus.DONE,
-                )
-            )
+    context_budget = prompt_budget(
+        llm.model,
+        CHAT_PROMPT.format(my_context="", my_query=query),
+        max_tokens=ANSWER_CONTEXT_TOKENS,
+    )
+    fmt_qa_prompt = CHAT_PROMPT.format(
+        my_context=format_context_with_steps(
+            search_result_map, state.step_context, llm.model, context_budget
+        ),
+        my_query=query,
+    )
 
-            thread_id = save_turn_to_db(
-                session=session,
-                thread_id=request.thread_id,
-                user_message=request.query,
-                assistant_message=full_response,
-                agent_search_full_response=AgentSearchFullResponse(
-                    steps=[step.step for step in agent_search_steps],
-                    steps_details=agent_search_steps,
-                ),
-                model=request.model,
-                search_results=search_results,
-                image_results=images,
-                related_queries=related_queries,
-            )
+    full_response = ""
+    response_gen = await llm.astream(fmt_qa_prompt)
+    async for completion in response_gen:
+        full_response += completion.delta or ""
+        yield ChatResponseEvent(
+            event=StreamEvent.TEXT_CHUNK,
+            data=TextChunkStream(text=completion.delta or ""),
+        )
+
+    related_queries = await (
+        related_queries_task
+        if related_queries_task
+        else generate_related_queries(query, search_results, llm)
+    )
 
-            yield ChatResponseEvent(
-                event=StreamEvent.STREAM_END,
-                data=StreamEndStream(thread_id=thread_id),
-            )
-            return
+    yield ChatResponseEvent(
+        event=StreamEvent.RELATED_QUERIES,
+        data=RelatedQueriesStream(related_queries=related_queries),
+    )
+
+    yield ChatResponseEvent(
+        event=StreamEvent.FINAL_RESPONSE,
+        data=FinalResponseStream(message=full_response),
+    )
+
+    # Report steps in plan order, not in the order they finished
+    agent_search_steps = [
+        state.agent_search_steps[search_step.id]
+        for search_step in search_steps
+        if search_step.id in state.agent_search_steps
+    ]
+    agent_search_steps.append(
+        AgentSearchStep(
+            step_number=step_id,
+            step=step.step,
+            queries=[],
+            results=[],
+            status=AgentSearchStepStatus.DONE,
+        )
+    )
+
+    thread_id = await persist_turn(
+        session=session,
+        thread_id=request.thread_id,
+        user_message=request.query,
+        assistant_message=full_response,
+        agent_search_full_response=AgentSearchFullResponse(
+            steps=[step.step for step in agent_search_steps],
+            steps_details=agent_search_steps,
+        ),
+        model=request.model,
+        search_results=search_results,
+        image_results=images,
+        related_queries=related_queries,
+    )
+
+    yield ChatResponseEvent(
+        event=StreamEvent.STREAM_END,
+        data=StreamEndStream(thread_id=thread_id),
+    )
 
 
 async def stream_pro_search_qa(
-    request: ChatRequest, session: Session
+    request: ChatRequest, session: AsyncSession
 ) -> AsyncIterator[ChatResponseEvent]:
     try:
         if not PRO_MODE_ENABLED:
@@ -305,9 +476,11 @@ async def stream_pro_search_qa(
             )
 
         model_name = get_model_string(request.model)
-        llm = EveryLLM(model=model_name)
+        llm = get_llm(model_name)
 
-        query = rephrase_query_with_history(request.query, request.history, llm)
+        query = await rephrase_query_with_history(
+            request.query, request.history, llm, request.thread_id
+        )
         async for event in stream_pro_search_objects(request, llm, query, session):
             yield event
             await asyncio.sleep(0)
@@ -0,0 +1,54 @@
+import os
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+
+redis_pool = (
+    redis.ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS)
+    if REDIS_URL
+    else None
+)
+redis_client = redis.Redis(connection_pool=redis_pool) if redis_pool else None
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Size-bounded in-process cache that evicts the least recently used entry."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[K, V] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def set(self, key: K, value: V):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: K):
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+async def close_redis():
+    if redis_pool:
+        await redis_pool.disconnect()
@@ -2,13 +2,28 @@ import asyncio
 from typing import AsyncIterator, List
 
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.constants import get_model_string
-from backend.db.chat import save_turn_to_db
-from backend.llm.base import BaseLLM, EveryLLM
+from backend.context_builder import (
+    ANSWER_CONTEXT_TOKENS,
+    pack_search_results,
+    prompt_budget,
+)
+from backend.db.writer import persist_turn
+from backend.llm.base import BaseLLM, get_llm
 from backend.prompts import CHAT_PROMPT, HISTORY_QUERY_REPHRASE
 from backend.related_queries import generate_related_queries
+from backend.rephrase import (
+    OPTIMISTIC_SEARCH_SIMILARITY,
+    FollowUp,
+    classify_follow_up,
+    get_cached_rephrase,
+    needs_rephrase,
+    query_similarity,
+    rephrase_cache_key,
+    set_cached_rephrase,
+)
 from backend.schemas import (
     BeginStream,
     ChatRequest,
@@ -16,58 +31,111 @@ from backend.schemas import (
     FinalResponseStream,
     Message,
     RelatedQueriesStream,
+    SearchResponse,
     SearchResult,
     SearchResultStream,
     StreamEndStream,
     StreamEvent,
     TextChunkStream,
 )
+from backend.search.dedup import dedupe_search_results
+from backend.search.rerank import rerank_search_results
 from backend.search.search_service import perform_search
-from backend.utils import is_local_model
+from backend.utils import OPTIMISTIC_SEARCH_ENABLED, is_local_model
 
 
-def rephrase_query_with_history(
-    question: str, history: List[Message], llm: BaseLLM
+async def rephrase_query_with_history(
+    question: str,
+    history: List[Message],
+    llm: BaseLLM,
+    thread_id: int | None = None,
 ) -> str:
-    if not history:
+    if not needs_rephrase(question, history):
         return question
 
+    cache_key = rephrase_cache_key(thread_id, history, question, llm.model)
+    if cached := await get_cached_rephrase(cache_key):
+        return cached
+
     try:
         history_str = "\n".join(f"{msg.role}: {msg.content}" for msg in history)
         formatted_query = HISTORY_QUERY_REPHRASE.format(
             chat_history=history_str, question=question
         )
-        question = llm.complete(formatted_query).text.replace('"', "")
-        return question
+        rephrased = (await llm.acomplete(formatted_query)).text.replace('"', "")
     except Exception:
         raise HTTPException(
             status_code=500, detail="Model is at capacity. Please try again later."
         )
 
+    await set_cached_rephrase(cache_key, rephrased)
+    return rephrased
+
+
+async def rephrase_and_search(
+    request: ChatRequest, llm: BaseLLM
+) -> tuple[str, SearchResponse]:
+    optimistic_search = None
+    if (
+        OPTIMISTIC_SEARCH_ENABLED
+        and classify_follow_up(request.query, request.history) == FollowUp.RELATED
+    ):
+        # Search the raw question while it's rephrased, the results are used if
+        # the rephrase turns out to barely change it. Questions with a pronoun
+        # or an ellipsis are skipped, their rephrase always replaces those words
+        optimistic_search = asyncio.create_task(perform_search(request.query))
+
+    try:
+        query = await rephrase_query_with_history(
+            request.query, request.history, llm, request.thread_id
+        )
+    except BaseException:
+        if optimistic_search:
+            optimistic_search.cancel()
+        raise
+
+    if optimistic_search:
+        if query_similarity(query, request.query) >= OPTIMISTIC_SEARCH_SIMILARITY:
+            return query, await optimistic_search
+        optimistic_search.cancel()
+
+    return query, await perform_search(query)
+
+
+def format_citation(i: int, result: SearchResult) -> str:
+    return f"Citation {i+1}. {str(result)}"
+
 
-def format_context(search_results: List[SearchResult]) -> str:
-    return "\n\n".join(
-        [f"Citation {i+1}. {str(result)}" for i, result in enumerate(search_results)]
+def format_context(
+    search_results: List[SearchResult], model: str, max_tokens: int
+) -> str:
+    _, context = pack_search_results(
+        search_results,
+        model=model,
+        max_tokens=max_tokens,
+        format_result=format_citation,
     )
+    return context
 
 
 async def stream_qa_objects(
-    request: ChatRequest, session: Session
+    request: ChatRequest, session: AsyncSession
 ) -> AsyncIterator[ChatResponseEvent]:
     try:
         model_name = get_model_string(request.model)
-        llm = EveryLLM(model=model_name)
+        llm = get_llm(model_name)
 
         yield ChatResponseEvent(
             event=StreamEvent.BEGIN_STREAM,
             data=BeginStream(query=request.query),
         )
 
-        query = rephrase_query_with_history(request.query, request.history, llm)
-
-        search_response = await perform_search(query)
+        query, search_response = await rephrase_and_search(request, llm)
 
-        search_results = search_response.results
+        # Rerank before anything is streamed, so citations refer to this order
+        search_results = rerank_search_results(
+            query, dedupe_search_results(search_response.results)
+        )
         images = search_response.images
 
         # Only create the task first if the model is not local
@@ -85,8 +153,13 @@ async def stream_qa_objects(
             ),
         )
 
+        context_budget = prompt_budget(
+            model_name,
+            CHAT_PROMPT.format(my_context="", my_query=query),
+            max_tokens=ANSWER_CONTEXT_TOKENS,
+        )
         fmt_qa_prompt = CHAT_PROMPT.format(
-            my_context=format_context(search_results),
+            my_context=format_context(search_results, model_name, context_budget),
             my_query=query,
         )
 
@@ -110,7 +183,7 @@ async def stream_qa_objects(
             data=RelatedQueriesStream(related_queries=related_queries),
         )
 
-        thread_id = save_turn_to_db(
+        thread_id = await persist_turn(
             session=session,
             thread_id=request.thread_id,
             user_message=request.query,
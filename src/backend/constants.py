@@ -48,3 +48,14 @@ def get_model_string(model: ChatModel) -> str:
             return f"azure/{name}"
 
     return model_mappings[model]
+
+
+def get_configured_model_strings() -> list[str]:
+    model_strings = []
+    for model in ChatModel:
+        try:
+            model_strings.append(get_model_string(model))
+        except (KeyError, ValueError):
+            # No mapping for the model, or CUSTOM_MODEL is not set
+            continue
+    return model_strings
@@ -0,0 +1,88 @@
+import os
+from functools import lru_cache
+from typing import Callable
+
+from dotenv import load_dotenv
+from litellm import get_model_info, token_counter
+
+from backend.schemas import SearchResult
+
+load_dotenv()
+
+
+# Used for models litellm has no context window for (e.g. custom or local ones)
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", 8192))
+# Overrides every model's window, e.g. to match Ollama's num_ctx
+CONTEXT_WINDOW = os.getenv("CONTEXT_WINDOW")
+# Room left for the model's answer
+CONTEXT_RESPONSE_TOKENS = int(os.getenv("CONTEXT_RESPONSE_TOKENS", 2048))
+
+# Caps on the search context, the model's window only bounds them from above.
+# Large-window models would otherwise be sent every result on every answer
+ANSWER_CONTEXT_TOKENS = int(os.getenv("ANSWER_CONTEXT_TOKENS", 4000))
+STEP_CONTEXT_TOKENS = int(os.getenv("STEP_CONTEXT_TOKENS", 2000))
+RELATED_QUERIES_CONTEXT_TOKENS = int(os.getenv("RELATED_QUERIES_CONTEXT_TOKENS", 1000))
+
+
+@lru_cache(maxsize=None)
+def get_context_window(model: str) -> int:
+    if CONTEXT_WINDOW:
+        return int(CONTEXT_WINDOW)
+    try:
+        return get_model_info(model)["max_input_tokens"] or DEFAULT_CONTEXT_WINDOW
+    except Exception:
+        return DEFAULT_CONTEXT_WINDOW
+
+
+def count_tokens(model: str, text: str) -> int:
+    try:
+        return token_counter(model=model, text=text)
+    except Exception:
+        # Rough estimate for when the model's tokenizer can't be loaded
+        return len(text) // 4
+
+
+def prompt_budget(model: str, prompt: str, max_tokens: int | None = None) -> int:
+    """Tokens left for context once the rest of the prompt and the answer fit.
+
+    `prompt` is the prompt formatted with an empty context.
+    """
+    budget = (
+        get_context_window(model)
+        - CONTEXT_RESPONSE_TOKENS
+        - count_tokens(model, prompt)
+    )
+    if max_tokens is not None:
+        budget = min(budget, max_tokens)
+    return max(budget, 0)
+
+
+def format_search_result(_: int, result: SearchResult) -> str:
+    return str(result)
+
+
+def pack_search_results(
+    search_results: list[SearchResult],
+    *,
+    model: str,
+    max_tokens: int,
+    format_result: Callable[[int, SearchResult], str] = format_search_result,
+    separator: str = "\n\n",
+) -> tuple[list[SearchResult], str]:
+    """Fit as many results as the budget allows, in rank order.
+
+    Results are never cut mid-text, the lowest ranked ones are dropped whole.
+    Packing stops at the first result that doesn't fit, so the kept results are
+    a prefix of `search_results` and citation numbers stay valid for both.
+    """
+    separator_tokens = count_tokens(model, separator)
+    parts: list[str] = []
+    used = 0
+    for i, result in enumerate(search_results):
+        part = format_result(i, result)
+        cost = count_tokens(model, part) + (separator_tokens if parts else 0)
+        if used + cost > max_tokens:
+            break
+        parts.append(part)
+        used += cost
+    return search_results[: len(parts)], separator.join(parts)
@@ -1,14 +1,22 @@
-import json
+import base64
+import hashlib
 import re
+from datetime import datetime
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy import ScalarSelect, func, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from backend.db.models import ChatMessage as DBChatMessage
 from backend.db.models import ChatThread as DBChatThread
+from backend.db.models import ChatThreadSummary as DBChatThreadSummary
 from backend.db.models import SearchResult as DBSearchResult
+from backend.db.models import WebDocument as DBWebDocument
+from backend.response_cache import invalidate_thread_responses
 from backend.schemas import (
     AgentSearchFullResponse,
+    ChatHistoryResponse,
     ChatMessage,
     ChatSnapshot,
     MessageRole,
@@ -17,188 +25,353 @@ from backend.schemas import (
 )
 from backend.utils import DB_ENABLED
 
+CITATION_REGEX = re.compile(r"\[[0-9]+\]")
 
-def create_chat_thread(*, session: Session, model_name: str):
-    chat_thread = DBChatThread(model_name=model_name)
-    session.add(chat_thread)
-    session.commit()
-    return chat_thread
+
+async def reserve_thread_id(*, session: AsyncSession) -> int:
+    """Allocate a thread id from the table's sequence without writing the thread,
+    so it can be handed to the client before the turn is persisted."""
+    stmt = select(
+        func.nextval(func.pg_get_serial_sequence(DBChatThread.__tablename__, "id"))
+    )
+    thread_id = (await session.execute(stmt)).scalar_one()
+    # Release the connection, nextval is not rolled back anyway
+    await session.commit()
+    return thread_id
+
+
+async def create_chat_thread(
+    *, session: AsyncSession, model_name: str, thread_id: int | None = None
+) -> int:
+    values = {"model_name": model_name}
+    if thread_id is not None:
+        values["id"] = thread_id
+    stmt = insert(DBChatThread).values(**values).returning(DBChatThread.id)
+    return (await session.execute(stmt)).scalar_one()
+
+
+def hash_url(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
 
 
-def create_search_results(
-    *, session: Session, search_results: list[SearchResult], chat_message_id: int
-) -> list[DBSearchResult]:
-    db_search_results = [
-        DBSearchResult(
-            url=result.url,
-            title=result.title,
-            content=result.content,
-            chat_message_id=chat_message_id,
+async def upsert_web_documents(
+    *, session: AsyncSession, search_results: list[SearchResult]
+) -> dict[str, int]:
+    """Store each distinct URL once and return the document id for every hash.
+
+    A document keeps the title and content it was first stored with. Rows are
+    inserted in hash order so concurrent turns lock documents in the same order.
+    """
+    documents = {hash_url(result.url): result for result in search_results}
+    if not documents:
+        return {}
+
+    stmt = (
+        pg_insert(DBWebDocument)
+        .values(
+            [
+                {
+                    "url_hash": url_hash,
+                    "url": result.url,
+                    "title": result.title,
+                    "content": result.content,
+                }
+                for url_hash, result in sorted(documents.items())
+            ]
         )
-        for result in search_results
-    ]
-    session.add_all(db_search_results)
-    session.commit()
-    return db_search_results
+        .on_conflict_do_nothing(index_elements=[DBWebDocument.url_hash])
+        .returning(DBWebDocument.url_hash, DBWebDocument.id)
+    )
+    document_ids = dict((await session.execute(stmt)).tuples().all())
+
+    # Documents that already existed aren't returned by DO NOTHING
+    if missing := documents.keys() - document_ids.keys():
+        stmt = select(DBWebDocument.url_hash, DBWebDocument.id).where(
+            DBWebDocument.url_hash.in_(missing)
+        )
+        document_ids.update((await session.execute(stmt)).tuples().all())
+    return document_ids
+
+
+async def create_search_results(
+    *, session: AsyncSession, search_results: list[SearchResult], chat_message_id: int
+):
+    if not search_results:
+        return
+
+    document_ids = await upsert_web_documents(
+        session=session, search_results=search_results
+    )
+    # A single executemany, batched into multi-row INSERTs by the driver
+    await session.execute(
+        insert(DBSearchResult),
+        [
+            {
+                "chat_message_id": chat_message_id,
+                "rank": rank,
+                "web_document_id": document_ids[hash_url(result.url)],
+            }
+            for rank, result in enumerate(search_results)
+        ],
+    )
 
 
-def append_message(
+async def append_message(
     *,
-    session: Session,
+    session: AsyncSession,
     thread_id: int,
     role: MessageRole,
     content: str,
     search_results: list[SearchResult] | None = None,
     image_results: list[str] | None = None,
     related_queries: list[str] | None = None,
-):
-    last_message = (
-        session.query(DBChatMessage)
-        .filter(DBChatMessage.chat_thread_id == thread_id)
-        .order_by(DBChatMessage.id.desc())
-        .first()
+) -> int:
+    # Resolve the parent inside the INSERT instead of a separate lookup query
+    last_message_id = (
+        select(func.max(DBChatMessage.id))
+        .where(DBChatMessage.chat_thread_id == thread_id)
+        .scalar_subquery()
     )
 
-    return create_message(
+    return await create_message(
         session=session,
         thread_id=thread_id,
         role=role,
         content=content,
-        parent_message_id=last_message.id if last_message else None,
+        parent_message_id=last_message_id,
         search_results=search_results,
         image_results=image_results,
         related_queries=related_queries,
     )
 
 
-def create_message(
+async def create_message(
     *,
-    session: Session,
+    session: AsyncSession,
     thread_id: int,
     role: MessageRole,
     content: str,
-    parent_message_id: int | None = None,
+    parent_message_id: int | ScalarSelect[int] | None = None,
     agent_search_full_response: AgentSearchFullResponse | None = None,
     search_results: list[SearchResult] | None = None,
     image_results: list[str] | None = None,
     related_queries: list[str] | None = None,
+) -> int:
+    stmt = (
+        insert(DBChatMessage)
+        .values(
+            chat_thread_id=thread_id,
+            role=role,
+            content=content,
+            parent_message_id=parent_message_id,
+            agent_search_full_response=(
+                agent_search_full_response.model_dump(mode="json")
+                if agent_search_full_response
+                else None
+            ),
+            image_results=image_results or [],
+            related_queries=related_queries or [],
+        )
+        .returning(DBChatMessage.id)
+    )
+    message_id = (await session.execute(stmt)).scalar_one()
+
+    if search_results is not None:
+        await create_search_results(
+            session=session, search_results=search_results, chat_message_id=message_id
+        )
+
+    return message_id
+
+
+async def update_thread_summary(
+    *,
+    session: AsyncSession,
+    thread_id: int,
+    user_message: str,
+    assistant_message: str,
+    model: str,
 ):
-    message = DBChatMessage(
+    # The first turn of a thread sets its title and preview, later turns only
+    # bump the count and last-updated time
+    stmt = pg_insert(DBChatThreadSummary).values(
         chat_thread_id=thread_id,
-        role=role,
-        content=content,
-        parent_message_id=parent_message_id,
-        agent_search_full_response=(
-            agent_search_full_response.model_dump_json()
-            if agent_search_full_response
-            else None
+        title=user_message,
+        # Remove citations from the preview
+        preview=CITATION_REGEX.sub("", assistant_message),
+        model_name=model,
+        message_count=2,
+        time_created=(
+            select(DBChatThread.time_created)
+            .where(DBChatThread.id == thread_id)
+            .scalar_subquery()
         ),
-        image_results=image_results or [],
-        related_queries=related_queries or [],
+        time_updated=func.now(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DBChatThreadSummary.chat_thread_id],
+        set_={
+            "message_count": DBChatThreadSummary.message_count + 2,
+            "time_updated": func.now(),
+        },
     )
+    await session.execute(stmt)
 
-    session.add(message)
-    session.flush()
 
-    db_search_results = None
-    if search_results is not None:
-        db_search_results = create_search_results(
-            session=session, search_results=search_results, chat_message_id=message.id
+async def insert_turn(
+    *,
+    session: AsyncSession,
+    thread_id: int | None,
+    user_message: str,
+    assistant_message: str,
+    model: str,
+    create_thread: bool = False,
+    agent_search_full_response: AgentSearchFullResponse | None = None,
+    search_results: list[SearchResult] | None = None,
+    image_results: list[str] | None = None,
+    related_queries: list[str] | None = None,
+) -> int:
+    """Add a turn to the session's transaction without committing it.
+    create_thread inserts the thread under an id from reserve_thread_id."""
+    if thread_id is None or create_thread:
+        thread_id = await create_chat_thread(
+            session=session, model_name=model, thread_id=thread_id
         )
-    message.search_results = db_search_results or []
 
-    session.add(message)
-    session.commit()
-    return message
+    user_message_id = await append_message(
+        session=session,
+        thread_id=thread_id,
+        role=MessageRole.USER,
+        content=user_message,
+    )
+
+    await create_message(
+        session=session,
+        thread_id=thread_id,
+        role=MessageRole.ASSISTANT,
+        content=assistant_message,
+        parent_message_id=user_message_id,
+        agent_search_full_response=agent_search_full_response,
+        search_results=search_results,
+        image_results=image_results,
+        related_queries=related_queries,
+    )
+
+    await update_thread_summary(
+        session=session,
+        thread_id=thread_id,
+        user_message=user_message,
+        assistant_message=assistant_message,
+        model=model,
+    )
+    return thread_id
 
 
-def save_turn_to_db(
+async def save_turn_to_db(
     *,
-    session: Session,
+    session: AsyncSession,
     thread_id: int | None,
     user_message: str,
     assistant_message: str,
     model: str,
+    create_thread: bool = False,
     agent_search_full_response: AgentSearchFullResponse | None = None,
     search_results: list[SearchResult] | None = None,
     image_results: list[str] | None = None,
     related_queries: list[str] | None = None,
 ) -> int | None:
     if DB_ENABLED:
-        if thread_id is None:
-            thread = create_chat_thread(session=session, model_name=model)
-            thread_id = thread.id
-        else:
-            thread_id = thread_id
-
-        user_message = append_message(
+        new_thread = create_thread or thread_id is None
+        # The whole turn is written in one transaction with a single commit
+        thread_id = await insert_turn(
             session=session,
             thread_id=thread_id,
-            role=MessageRole.USER,
-            content=user_message,
-        )
-
-        _assistant_message = create_message(
-            session=session,
-            thread_id=thread_id,
-            role=MessageRole.ASSISTANT,
-            content=assistant_message,
-            parent_message_id=user_message.id,
+            user_message=user_message,
+            assistant_message=assistant_message,
+            model=model,
+            create_thread=create_thread,
             agent_search_full_response=agent_search_full_response,
             search_results=search_results,
             image_results=image_results,
             related_queries=related_queries,
         )
+        await session.commit()
+        await invalidate_thread_responses([thread_id], history=new_thread)
         return thread_id
     return None
 
 
-def get_chat_history(*, session: Session) -> list[ChatSnapshot]:
-    threads = (
-        session.query(DBChatThread)
-        .join(DBChatThread.messages)
-        .options(contains_eager(DBChatThread.messages))
-        .order_by(DBChatThread.time_created.desc(), DBChatMessage.id.asc())
-        .all()
-    )
-    threads = [thread for thread in threads if len(thread.messages) > 1]
+def encode_history_cursor(snapshot: ChatSnapshot) -> str:
+    cursor = f"{snapshot.date.isoformat()}|{snapshot.id}"
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
 
-    snapshots = []
-    for thread in threads:
-        title = thread.messages[0].content
-        preview = thread.messages[1].content
 
-        # Remove citations from the preview
-        citation_regex = re.compile(r"\[[0-9]+\]")
-        preview = citation_regex.sub("", preview)
-
-        snapshots.append(
-            ChatSnapshot(
-                id=thread.id,
-                title=title,
-                date=thread.time_created,
-                preview=preview,
-                model_name=thread.model_name,
-            )
+def decode_history_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        date, thread_id = base64.urlsafe_b64decode(cursor).decode().split("|")
+        return datetime.fromisoformat(date), int(thread_id)
+    except ValueError:
+        raise ValueError("Invalid history cursor")
+
+
+async def get_chat_history(
+    *, session: AsyncSession, limit: int, cursor: str | None = None
+) -> ChatHistoryResponse:
+    # A single range scan over the (time_created, chat_thread_id) summary index
+    stmt = select(DBChatThreadSummary)
+    if cursor is not None:
+        time_created, thread_id = decode_history_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(DBChatThreadSummary.time_created, DBChatThreadSummary.chat_thread_id)
+            < tuple_(time_created, thread_id)
+        )
+    # Fetch one extra row to know whether there is a next page
+    stmt = stmt.order_by(
+        DBChatThreadSummary.time_created.desc(),
+        DBChatThreadSummary.chat_thread_id.desc(),
+    ).limit(limit + 1)
+    summaries = (await session.execute(stmt)).scalars().all()
+
+    snapshots = [
+        ChatSnapshot(
+            id=summary.chat_thread_id,
+            title=summary.title,
+            date=summary.time_created,
+            preview=summary.preview,
+            model_name=summary.model_name,
         )
-    return snapshots
+        for summary in summaries[:limit]
+    ]
+    next_cursor = (
+        encode_history_cursor(snapshots[-1]) if len(summaries) > limit else None
+    )
+    return ChatHistoryResponse(snapshots=snapshots, next_cursor=next_cursor)
 
 
 def map_search_result(search_result: DBSearchResult) -> SearchResult:
+    document = search_result.web_document
     return SearchResult(
-        url=search_result.url,
-        title=search_result.title,
-        content=search_result.content,
+        url=document.url,
+        title=document.title,
+        content=document.content,
     )
 
 
-def get_thread(*, session: Session, thread_id: int) -> ThreadResponse:
+async def get_thread(*, session: AsyncSession, thread_id: int) -> ThreadResponse:
+    # Load every message's search results, joined to their documents, in one
+    # extra IN query rather than one query per message, so long threads still
+    # take exactly two round trips
     stmt = (
         select(DBChatMessage)
         .where(DBChatMessage.chat_thread_id == thread_id)
+        .options(
+            selectinload(DBChatMessage.search_results).joinedload(
+                DBSearchResult.web_document
+            )
+        )
         .order_by(DBChatMessage.id.asc())
     )
-    db_messages = session.execute(stmt).scalars().all()
+    db_messages = (await session.execute(stmt)).scalars().all()
     if len(db_messages) == 0:
         raise ValueError(f"Thread with id {thread_id} not found")
 
@@ -212,8 +385,8 @@ def get_thread(*, session: Session, thread_id: int) -> ThreadResponse:
             ],
             images=message.image_results or [],
             agent_response=(
-                AgentSearchFullResponse(
-                    **json.loads(message.agent_search_full_response)
+                AgentSearchFullResponse.model_validate(
+                    message.agent_search_full_response
                 )
                 if message.agent_search_full_response
                 else None
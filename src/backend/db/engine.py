@@ -1,8 +1,10 @@
 import os
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.utils import strtobool
 
 load_dotenv()
 
@@ -17,14 +19,45 @@ DATABASE_URL = (
     or f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = strtobool(os.environ.get("DB_POOL_PRE_PING", True))
+
 
 def create_connection_string():
     return DATABASE_URL
 
 
-engine = create_engine(create_connection_string())
+def create_async_connection_string():
+    # DATABASE_URL keeps the sync driver for alembic, the app talks through asyncpg.
+    # asyncpg rejects libpq's `sslmode` in the URL, it's passed as `ssl` instead
+    return (
+        make_url(DATABASE_URL)
+        .set(drivername="postgresql+asyncpg")
+        .difference_update_query(["sslmode"])
+    )
+
+
+def create_async_connect_args():
+    # asyncpg's `ssl` takes the same modes as libpq's sslmode
+    sslmode = make_url(DATABASE_URL).query.get("sslmode")
+    return {"ssl": sslmode} if sslmode else {}
+
+
+engine = create_async_engine(
+    create_async_connection_string(),
+    connect_args=create_async_connect_args(),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    async with async_session() as session:
         yield session
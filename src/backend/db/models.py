@@ -1,6 +1,6 @@
 import datetime
 
-from sqlalchemy import ARRAY, DateTime, Enum, ForeignKey, String, func
+from sqlalchemy import ARRAY, DateTime, Enum, ForeignKey, Index, Integer, String, func
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Mapped, declarative_base, mapped_column, relationship
 
@@ -28,21 +28,67 @@ class ChatThread(Base):
     )
 
 
-class SearchResult(Base):
-    __tablename__ = "search_result"
-    id: Mapped[int] = mapped_column(primary_key=True)
+class ChatThreadSummary(Base):
+    """Projection of a thread for the history listing, kept up to date on every
+    saved turn so listing history doesn't have to read any messages."""
+
+    __tablename__ = "chat_thread_summary"
+    __table_args__ = (
+        Index(
+            "ix_chat_thread_summary_time_created_chat_thread_id",
+            "time_created",
+            "chat_thread_id",
+        ),
+    )
+    chat_thread_id: Mapped[int] = mapped_column(
+        ForeignKey("chat_thread.id"), primary_key=True
+    )
     title: Mapped[str] = mapped_column(String)
+    preview: Mapped[str] = mapped_column(String)
+    model_name: Mapped[str] = mapped_column(String)
+    message_count: Mapped[int] = mapped_column(Integer)
+
+    time_created: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
+    time_updated: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class WebDocument(Base):
+    """A fetched page, stored once per URL and shared by every message citing it."""
+
+    __tablename__ = "web_document"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # sha256 of the URL, so long URLs can be looked up through a fixed-size key
+    url_hash: Mapped[str] = mapped_column(String(64), unique=True)
     url: Mapped[str] = mapped_column(String)
+    title: Mapped[str] = mapped_column(String)
     content: Mapped[str] = mapped_column(String)
 
-    chat_message_id: Mapped[int] = mapped_column(ForeignKey("chat_message.id"))
+    time_created: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class SearchResult(Base):
+    __tablename__ = "search_result"
+    chat_message_id: Mapped[int] = mapped_column(
+        ForeignKey("chat_message.id"), primary_key=True
+    )
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    web_document_id: Mapped[int] = mapped_column(ForeignKey("web_document.id"))
+
     chat_message: Mapped["ChatMessage"] = relationship(
         "ChatMessage", back_populates="search_results"
     )
+    web_document: Mapped[WebDocument] = relationship(WebDocument)
 
 
 class ChatMessage(Base):
     __tablename__ = "chat_message"
+    __table_args__ = (
+        Index("ix_chat_message_chat_thread_id_id", "chat_thread_id", "id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     role: Mapped[MessageRole] = mapped_column(Enum(MessageRole))
     content: Mapped[str] = mapped_column(String)
@@ -56,7 +102,7 @@ class ChatMessage(Base):
     )
 
     # AI Only
-    agent_search_full_response: Mapped[str | None] = mapped_column(
+    agent_search_full_response: Mapped[dict | None] = mapped_column(
         postgresql.JSONB, nullable=True
     )
 
@@ -68,5 +114,5 @@ class ChatMessage(Base):
     )
 
     search_results: Mapped[list[SearchResult] | None] = relationship(
-        SearchResult, back_populates="chat_message"
+        SearchResult, back_populates="chat_message", order_by=SearchResult.rank
     )
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import traceback
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.chat import insert_turn, reserve_thread_id, save_turn_to_db
+from backend.db.engine import async_session
+from backend.response_cache import invalidate_thread_responses
+from backend.schemas import AgentSearchFullResponse, SearchResult
+from backend.utils import DB_ENABLED
+
+load_dotenv()
+
+
+TURN_WRITER_QUEUE_SIZE = int(os.getenv("TURN_WRITER_QUEUE_SIZE", 1000))
+TURN_WRITER_BATCH_SIZE = int(os.getenv("TURN_WRITER_BATCH_SIZE", 50))
+TURN_WRITER_MAX_RETRIES = int(os.getenv("TURN_WRITER_MAX_RETRIES", 3))
+TURN_WRITER_RETRY_DELAY = float(os.getenv("TURN_WRITER_RETRY_DELAY", 0.5))
+
+
+class ChatTurn(BaseModel):
+    thread_id: int | None
+    user_message: str
+    assistant_message: str
+    model: str
+    create_thread: bool = False
+    agent_search_full_response: AgentSearchFullResponse | None = None
+    search_results: list[SearchResult] | None = None
+    image_results: list[str] = Field(default_factory=list)
+    related_queries: list[str] = Field(default_factory=list)
+
+
+async def write_turns(turns: list[ChatTurn]):
+    async with async_session() as session:
+        for turn in turns:
+            await insert_turn(session=session, **dict(turn))
+        await session.commit()
+
+    await invalidate_thread_responses(
+        [turn.thread_id for turn in turns if turn.thread_id is not None],
+        history=any(turn.create_thread for turn in turns),
+    )
+
+
+class TurnWriter:
+    """Persists chat turns in the background so streams don't wait on Postgres.
+
+    Turns are queued (bounded, so a slow database applies backpressure instead of
+    growing memory) and a single worker drains them in batches, one transaction
+    per batch. A single worker also keeps turns of the same thread in order.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = TURN_WRITER_QUEUE_SIZE,
+        batch_size: int = TURN_WRITER_BATCH_SIZE,
+        max_retries: int = TURN_WRITER_MAX_RETRIES,
+        retry_delay: float = TURN_WRITER_RETRY_DELAY,
+    ):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue[ChatTurn] | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the worker."""
+        if self.queue is None or self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.queue = self.task = None
+
+    async def enqueue(self, turn: ChatTurn):
+        assert self.queue is not None, "TurnWriter has not been started"
+        await self.queue.put(turn)
+
+    async def run(self):
+        assert self.queue is not None
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                await self.write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def write_batch(self, batch: list[ChatTurn]):
+        if await self.write_with_retry(batch):
+            return
+        # One bad turn shouldn't take the rest of the batch down with it
+        if len(batch) > 1:
+            for turn in batch:
+                await self.write_with_retry([turn])
+
+    async def write_with_retry(self, turns: list[ChatTurn]) -> bool:
+        for attempt in range(self.max_retries):
+            try:
+                await write_turns(turns)
+                return True
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    print(f"Dropping {len(turns)} chat turn(s) after retries failed")
+                    print(traceback.format_exc())
+                    return False
+                await asyncio.sleep(self.retry_delay * 2**attempt)
+        return False
+
+
+turn_writer = TurnWriter()
+
+
+async def persist_turn(
+    *,
+    session: AsyncSession,
+    thread_id: int | None,
+    user_message: str,
+    assistant_message: str,
+    model: str,
+    agent_search_full_response: AgentSearchFullResponse | None = None,
+    search_results: list[SearchResult] | None = None,
+    image_results: list[str] | None = None,
+    related_queries: list[str] | None = None,
+) -> int | None:
+    """Hand a turn to the background writer and return its thread id right away.
+
+    New threads get their id reserved up front. Falls back to writing inline
+    when the writer isn't running (e.g. outside the FastAPI app).
+    """
+    if not DB_ENABLED:
+        return None
+
+    if not turn_writer.running:
+        return await save_turn_to_db(
+            session=session,
+            thread_id=thread_id,
+            user_message=user_message,
+            assistant_message=assistant_message,
+            model=model,
+            agent_search_full_response=agent_search_full_response,
+            search_results=search_results,
+            image_results=image_results,
+            related_queries=related_queries,
+        )
+
+    create_thread = thread_id is None
+    if create_thread:
+        thread_id = await reserve_thread_id(session=session)
+
+    await turn_writer.enqueue(
+        ChatTurn(
+            thread_id=thread_id,
+            user_message=user_message,
+            assistant_message=assistant_message,
+            model=model,
+            create_thread=create_thread,
+            agent_search_full_response=agent_search_full_response,
+            search_results=search_results,
+            image_results=image_results or [],
+            related_queries=related_queries or [],
+        )
+    )
+    return thread_id
@@ -1,21 +1,91 @@
+import hashlib
 import os
+import time
 from abc import ABC, abstractmethod
 
+import httpx
 import instructor
+import litellm
 from dotenv import load_dotenv
 from instructor.client import T
-from litellm import completion
+from litellm import acompletion, completion
 from litellm.utils import validate_environment
 from llama_index.core.base.llms.types import (
     CompletionResponse,
     CompletionResponseAsyncGen,
 )
 from llama_index.llms.litellm import LiteLLM
+from pydantic import ValidationError
+
+from backend.cache import LRUCache, redis_client
+from backend.utils import strtobool
 
 load_dotenv()
 
 
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", 600))
+
+LLM_CACHE_ENABLED = strtobool(os.getenv("LLM_CACHE_ENABLED", True))
+LLM_MEMORY_CACHE_SIZE = int(os.getenv("LLM_MEMORY_CACHE_SIZE", 1024))
+# Seconds structured responses are reused for, per call type
+RELATED_QUERIES_CACHE_TTL = int(os.getenv("RELATED_QUERIES_CACHE_TTL", 86400))
+QUERY_PLAN_CACHE_TTL = int(os.getenv("QUERY_PLAN_CACHE_TTL", 86400))
+SEARCH_QUERIES_CACHE_TTL = int(os.getenv("SEARCH_QUERIES_CACHE_TTL", 3600))
+
+# Values are (expires_at, serialized response)
+memory_cache: LRUCache[str, tuple[float, str]] = LRUCache(maxsize=LLM_MEMORY_CACHE_SIZE)
+
+
+def llm_cache_key(model: str, response_model: type[T], prompt: str) -> str:
+    # The schema is part of the key so changing a response model can't serve
+    # responses in the old shape
+    schema = str(response_model.model_json_schema())
+    digest = hashlib.sha256(f"{model}\0{schema}\0{prompt}".encode()).hexdigest()
+    return f"llm:{response_model.__name__}:{digest}"
+
+
+async def get_cached_llm_response(key: str, response_model: type[T]) -> T | None:
+    cached = None
+    if entry := memory_cache.get(key):
+        expires_at, cached = entry
+        if expires_at < time.time():
+            memory_cache.delete(key)
+            cached = None
+
+    if cached is None and redis_client:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.pttl(key)
+            value, ttl_ms = await pipe.execute()
+        if value is not None:
+            cached = value.decode()
+            # Keep it in memory for as long as Redis still has it
+            if ttl_ms > 0:
+                memory_cache.set(key, (time.time() + ttl_ms / 1000, cached))
+
+    if cached is None:
+        return None
+
+    try:
+        return response_model.model_validate_json(cached)
+    except ValidationError:
+        return None
+
+
+async def set_cached_llm_response(key: str, response: T, ttl: int):
+    serialized = response.model_dump_json()
+    memory_cache.set(key, (time.time() + ttl, serialized))
+    if redis_client:
+        await redis_client.set(key, serialized, ex=ttl)
+
+
 class BaseLLM(ABC):
+    model: str
+
     @abstractmethod
     async def astream(self, prompt: str) -> CompletionResponseAsyncGen:
         pass
@@ -28,6 +98,16 @@ class BaseLLM(ABC):
     def structured_complete(self, response_model: type[T], prompt: str) -> T:
         pass
 
+    @abstractmethod
+    async def acomplete(self, prompt: str) -> CompletionResponse:
+        pass
+
+    @abstractmethod
+    async def astructured_complete(
+        self, response_model: type[T], prompt: str, cache_ttl: int | None = None
+    ) -> T:
+        pass
+
 
 class EveryLLM(BaseLLM):
     def __init__(
@@ -40,11 +120,14 @@ class EveryLLM(BaseLLM):
         if validation["missing_keys"]:
             raise ValueError(f"Missing keys: {validation['missing_keys']}")
 
+        self.model = model
         self.llm = LiteLLM(model=model)
-        if 'groq' in model or 'ollama_chat' in model:
-            self.client = instructor.from_litellm(completion, mode=instructor.Mode.MD_JSON)
+        if "groq" in model or "ollama_chat" in model:
+            mode = instructor.Mode.MD_JSON
         else:
-            self.client = instructor.from_litellm(completion)
+            mode = instructor.Mode.TOOLS
+        self.client = instructor.from_litellm(completion, mode=mode)
+        self.aclient = instructor.from_litellm(acompletion, mode=mode)
 
     async def astream(self, prompt: str) -> CompletionResponseAsyncGen:
         return await self.llm.astream_complete(prompt)
@@ -58,3 +141,81 @@ class EveryLLM(BaseLLM):
             messages=[{"role": "user", "content": prompt}],
             response_model=response_model,
         )
+
+    async def acomplete(self, prompt: str) -> CompletionResponse:
+        return await self.llm.acomplete(prompt)
+
+    async def astructured_complete(
+        self, response_model: type[T], prompt: str, cache_ttl: int | None = None
+    ) -> T:
+        """With a `cache_ttl`, identical prompts to the same model reuse the
+        response for that many seconds."""
+        if not cache_ttl or not LLM_CACHE_ENABLED:
+            return await self.aclient.chat.completions.create(
+                model=self.llm.model,
+                messages=[{"role": "user", "content": prompt}],
+                response_model=response_model,
+            )
+
+        key = llm_cache_key(self.model, response_model, prompt)
+        if (cached := await get_cached_llm_response(key, response_model)) is not None:
+            return cached
+
+        response = await self.astructured_complete(response_model, prompt)
+        await set_cached_llm_response(key, response, cache_ttl)
+        return response
+
+
+# Clients are stateless between calls, so one per model is shared by every
+# request in the process
+_llm_pool: dict[str, EveryLLM] = {}
+
+
+def get_llm(model: str) -> EveryLLM:
+    """Return the pooled client for a model, creating it on first use.
+
+    Models whose environment doesn't validate aren't pooled, so the error is
+    raised again on the next request rather than cached.
+    """
+    llm = _llm_pool.get(model)
+    if llm is None:
+        llm = EveryLLM(model=model)
+        _llm_pool[model] = llm
+    return llm
+
+
+def init_llm_pool(models: list[str]):
+    """Validate and build clients for the configured models once at startup,
+    and give litellm long-lived HTTP sessions so connections to the providers
+    are kept alive across requests."""
+    litellm.client_session = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=LLM_HTTP_TIMEOUT,
+    )
+    litellm.aclient_session = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=LLM_HTTP_TIMEOUT,
+    )
+
+    for model in models:
+        try:
+            get_llm(model)
+        except ValueError:
+            # Not configured here, requests for it keep failing with the error
+            continue
+
+
+async def close_llm_pool():
+    _llm_pool.clear()
+    if litellm.client_session:
+        litellm.client_session.close()
+        litellm.client_session = None
+    if litellm.aclient_session:
+        await litellm.aclient_session.aclose()
+        litellm.aclient_session = None
@@ -2,23 +2,33 @@ import asyncio
 import json
 import os
 import traceback
+from contextlib import asynccontextmanager
 from typing import Generator
 
 import logfire
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_ipaddr
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sse_starlette.sse import EventSourceResponse, ServerSentEvent
 
 from backend.agent_search import stream_pro_search_qa
+from backend.cache import close_redis
 from backend.chat import stream_qa_objects
+from backend.constants import get_configured_model_strings
 from backend.db.chat import get_chat_history, get_thread
 from backend.db.engine import get_session
+from backend.db.writer import turn_writer
+from backend.llm.base import close_llm_pool, init_llm_pool
+from backend.response_cache import (
+    HISTORY_VERSION_KEY,
+    cached_json_response,
+    thread_version_key,
+)
 from backend.schemas import (
     ChatHistoryResponse,
     ChatRequest,
@@ -27,12 +37,18 @@ from backend.schemas import (
     StreamEvent,
     ThreadResponse,
 )
+from backend.search.http_client import close_http_clients
+from backend.search.search_service import init_search_provider
 from backend.utils import strtobool
 from backend.validators import validate_model
 
 load_dotenv()
 
 
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+
 def create_error_event(detail: str):
     obj = ChatResponseEvent(
         data=ErrorStream(detail=detail),
@@ -82,8 +98,20 @@ def configure_middleware(app: FastAPI):
     )
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_search_provider()
+    init_llm_pool(get_configured_model_strings())
+    turn_writer.start()
+    yield
+    await turn_writer.stop()
+    await close_llm_pool()
+    await close_http_clients()
+    await close_redis()
+
+
 def create_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     configure_middleware(app)
     configure_logging(app, os.getenv("LOGFIRE_TOKEN"))
     configure_rate_limiting(
@@ -100,7 +128,9 @@ app = create_app()
 @app.post("/chat")
 @app.state.limiter.limit("4/min")
 async def chat(
-    chat_request: ChatRequest, request: Request, session: Session = Depends(get_session)
+    chat_request: ChatRequest,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
 ) -> Generator[ChatResponseEvent, None, None]:
     async def generator():
         try:
@@ -122,13 +152,26 @@ async def chat(
     return EventSourceResponse(generator(), media_type="text/event-stream")  # type: ignore
 
 
-@app.get("/history")
-async def recents(session: Session = Depends(get_session)) -> ChatHistoryResponse:
+@app.get("/history", response_model=ChatHistoryResponse)
+async def recents(
+    request: Request,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_session),
+) -> Response:
     DB_ENABLED = strtobool(os.environ.get("DB_ENABLED", "true"))
     if DB_ENABLED:
         try:
-            history = get_chat_history(session=session)
-            return ChatHistoryResponse(snapshots=history)
+            return await cached_json_response(
+                request,
+                resource=f"history:{limit}:{cursor}",
+                version_key=HISTORY_VERSION_KEY,
+                load=lambda: get_chat_history(
+                    session=session, limit=limit, cursor=cursor
+                ),
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     else:
@@ -138,9 +181,13 @@ async def recents(session: Session = Depends(get_session)) -> ChatHistoryRespons
         )
 
 
-@app.get("/thread/{thread_id}")
+@app.get("/thread/{thread_id}", response_model=ThreadResponse)
 async def thread(
-    thread_id: int, session: Session = Depends(get_session)
-) -> ThreadResponse:
-    thread = get_thread(session=session, thread_id=thread_id)
-    return thread
+    thread_id: int, request: Request, session: AsyncSession = Depends(get_session)
+) -> Response:
+    return await cached_json_response(
+        request,
+        resource=f"thread:{thread_id}",
+        version_key=thread_version_key(thread_id),
+        load=lambda: get_thread(session=session, thread_id=thread_id),
+    )
@@ -1,4 +1,9 @@
-from backend.llm.base import BaseLLM
+from backend.context_builder import (
+    RELATED_QUERIES_CONTEXT_TOKENS,
+    pack_search_results,
+    prompt_budget,
+)
+from backend.llm.base import RELATED_QUERIES_CACHE_TTL, BaseLLM
 from backend.prompts import RELATED_QUESTION_PROMPT
 from backend.schemas import RelatedQueries, SearchResult
 
@@ -6,10 +11,18 @@ from backend.schemas import RelatedQueries, SearchResult
 async def generate_related_queries(
     query: str, search_results: list[SearchResult], llm: BaseLLM
 ) -> list[str]:
-    context = "\n\n".join([f"{str(result)}" for result in search_results])
-    context = context[:4000]
-    related = llm.structured_complete(
-        RelatedQueries, RELATED_QUESTION_PROMPT.format(query=query, context=context)
+    max_tokens = prompt_budget(
+        llm.model,
+        RELATED_QUESTION_PROMPT.format(query=query, context=""),
+        max_tokens=RELATED_QUERIES_CONTEXT_TOKENS,
+    )
+    _, context = pack_search_results(
+        search_results, model=llm.model, max_tokens=max_tokens
+    )
+    related = await llm.astructured_complete(
+        RelatedQueries,
+        RELATED_QUESTION_PROMPT.format(query=query, context=context),
+        cache_ttl=RELATED_QUERIES_CACHE_TTL,
     )
 
     return [query.lower().replace("?", "") for query in related.related_questions]
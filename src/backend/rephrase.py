@@ -0,0 +1,162 @@
+import hashlib
+import os
+from enum import Enum
+
+import orjson
+from dotenv import load_dotenv
+
+from backend.cache import LRUCache, redis_client
+from backend.schemas import Message
+from backend.search.cache import STOP_WORDS, normalize_query
+from backend.search.rerank import tokenize
+
+load_dotenv()
+
+
+REPHRASE_CACHE_TTL = int(os.getenv("REPHRASE_CACHE_TTL", 86400))
+REPHRASE_MEMORY_CACHE_SIZE = int(os.getenv("REPHRASE_MEMORY_CACHE_SIZE", 1024))
+# How similar the rephrased query must be to the raw one for the optimistic
+# search on the raw question to be used
+OPTIMISTIC_SEARCH_SIMILARITY = float(os.getenv("OPTIMISTIC_SEARCH_SIMILARITY", 0.8))
+# Questions with fewer content words than this rarely stand on their own
+REPHRASE_MIN_TOKENS = int(os.getenv("REPHRASE_MIN_TOKENS", 3))
+# Questions with at least this many content words are treated as standalone
+REPHRASE_STANDALONE_TOKENS = int(os.getenv("REPHRASE_STANDALONE_TOKENS", 8))
+
+# Words that point back at something said earlier in the conversation
+ANAPHORA = {
+    "it",
+    "its",
+    "they",
+    "them",
+    "their",
+    "theirs",
+    "this",
+    "that",
+    "these",
+    "those",
+    "he",
+    "him",
+    "his",
+    "she",
+    "her",
+    "hers",
+    "former",
+    "latter",
+    "above",
+    "same",
+    "there",
+    "else",
+    "instead",
+    "one",
+    "ones",
+}
+# Openings of elliptical follow-ups, e.g. "what about rust?"
+FOLLOW_UP_PREFIXES = (
+    ("what", "about"),
+    ("how", "about"),
+    ("and",),
+    ("also",),
+    ("but",),
+    ("compared",),
+    ("vs",),
+    ("more",),
+)
+QUESTION_WORDS = {"what", "who", "when", "where", "why", "how", "which", "can"}
+# Say nothing about the topic, so they don't count as content words either
+AUXILIARY_VERBS = {"is", "are", "was", "were", "am", "be", "been", "do", "does", "did"}
+
+memory_cache: LRUCache[str, str] = LRUCache(maxsize=REPHRASE_MEMORY_CACHE_SIZE)
+
+
+class FollowUp(str, Enum):
+    # Stands on its own, no rephrase needed
+    STANDALONE = "standalone"
+    # Has a pronoun, an elliptical opening or too few words to stand alone
+    DEPENDENT = "dependent"
+    # Mid-length and shares words with the conversation, it may or may not
+    # need the history
+    RELATED = "related"
+
+
+def classify_follow_up(question: str, history: list[Message]) -> FollowUp:
+    """Cheap check for whether a follow-up depends on the conversation.
+
+    Questions that are long enough to stand alone, and mid-length ones that
+    share no words with the conversation (a change of topic), are standalone.
+    Anything with a pronoun, an elliptical opening or too few words depends on
+    it. Errs towards depending for text it can't judge, e.g. scripts without
+    spaces between words.
+    """
+    if not history:
+        return FollowUp.STANDALONE
+
+    tokens = tokenize(question)
+    if any(token in ANAPHORA for token in tokens):
+        return FollowUp.DEPENDENT
+    if any(tuple(tokens[: len(prefix)]) == prefix for prefix in FOLLOW_UP_PREFIXES):
+        return FollowUp.DEPENDENT
+
+    content = {
+        token
+        for token in tokens
+        if token not in STOP_WORDS
+        and token not in QUESTION_WORDS
+        and token not in AUXILIARY_VERBS
+    }
+    if len(content) < REPHRASE_MIN_TOKENS:
+        return FollowUp.DEPENDENT
+    if len(content) >= REPHRASE_STANDALONE_TOKENS:
+        return FollowUp.STANDALONE
+
+    history_tokens = {
+        token for message in history for token in tokenize(message.content)
+    }
+    if content.isdisjoint(history_tokens):
+        return FollowUp.STANDALONE
+    return FollowUp.RELATED
+
+
+def needs_rephrase(question: str, history: list[Message]) -> bool:
+    return classify_follow_up(question, history) != FollowUp.STANDALONE
+
+
+def query_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the two queries' normalized terms."""
+    a_terms = set(normalize_query(a).split())
+    b_terms = set(normalize_query(b).split())
+    if not a_terms or not b_terms:
+        return float(a_terms == b_terms)
+    return len(a_terms & b_terms) / len(a_terms | b_terms)
+
+
+def rephrase_cache_key(
+    thread_id: int | None, history: list[Message], question: str, model: str
+) -> str:
+    history_hash = hashlib.sha256(
+        orjson.dumps([[message.role, message.content] for message in history])
+    ).hexdigest()
+    question_hash = hashlib.sha256(question.encode()).hexdigest()
+    return f"rephrase:{model}:{thread_id}:{history_hash}:{question_hash}"
+
+
+async def get_cached_rephrase(key: str) -> str | None:
+    if rephrased := memory_cache.get(key):
+        return rephrased
+
+    if not redis_client:
+        return None
+
+    rephrased = await redis_client.get(key)
+    if rephrased is None:
+        return None
+
+    rephrased = rephrased.decode()
+    memory_cache.set(key, rephrased)
+    return rephrased
+
+
+async def set_cached_rephrase(key: str, rephrased: str):
+    memory_cache.set(key, rephrased)
+    if redis_client:
+        await redis_client.set(key, rephrased, ex=REPHRASE_CACHE_TTL)
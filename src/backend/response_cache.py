@@ -0,0 +1,142 @@
+import hashlib
+import os
+import secrets
+import traceback
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from backend.cache import LRUCache, redis_client
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+# Versions must be shared by every worker for invalidation to reach them all,
+# so the cache is only on with Redis
+RESPONSE_CACHE_ENABLED = (
+    strtobool(os.getenv("RESPONSE_CACHE_ENABLED", True)) and redis_client is not None
+)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_MEMORY_CACHE_SIZE = int(os.getenv("RESPONSE_MEMORY_CACHE_SIZE", 512))
+
+HISTORY_VERSION_KEY = "response_version:history"
+
+# Every cached resource has a version token that is replaced whenever the data
+# behind it changes. Bodies are stored under (resource, version), so an entry
+# never changes once written and invalidating is just writing a new token.
+# Versions always live in Redis, only the immutable bodies are kept in memory.
+memory_bodies: LRUCache[str, bytes] = LRUCache(maxsize=RESPONSE_MEMORY_CACHE_SIZE)
+
+
+def thread_version_key(thread_id: int) -> str:
+    return f"response_version:thread:{thread_id}"
+
+
+def new_version() -> str:
+    # Random rather than a counter, so a flushed Redis can't hand out a version
+    # a client already holds an ETag for
+    return secrets.token_hex(8)
+
+
+async def get_version(key: str) -> str:
+    assert redis_client is not None
+    # Only set when missing, so concurrent readers agree on the same version
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(key, new_version(), nx=True, ex=RESPONSE_CACHE_TTL)
+        pipe.get(key)
+        _, version = await pipe.execute()
+    return version.decode()
+
+
+async def bump_versions(keys: list[str]):
+    if not keys:
+        return
+
+    assert redis_client is not None
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.set(key, new_version(), ex=RESPONSE_CACHE_TTL)
+        await pipe.execute()
+
+
+async def invalidate_thread_responses(thread_ids: list[int], history: bool = False):
+    """Called after a turn is committed. The history listing only changes when
+    a thread is created, follow-up turns leave its title and preview alone."""
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    keys = [thread_version_key(thread_id) for thread_id in set(thread_ids)]
+    if history:
+        keys.append(HISTORY_VERSION_KEY)
+    try:
+        await bump_versions(keys)
+    except RedisError:
+        # The turn is already committed, stale responses age out with the TTL
+        print(traceback.format_exc())
+
+
+async def get_cached_body(key: str) -> bytes | None:
+    if body := memory_bodies.get(key):
+        return body
+
+    if not redis_client:
+        return None
+
+    body = await redis_client.get(key)
+    if body is not None:
+        memory_bodies.set(key, body)
+    return body
+
+
+async def set_cached_body(key: str, body: bytes):
+    memory_bodies.set(key, body)
+    if redis_client:
+        await redis_client.set(key, body, ex=RESPONSE_CACHE_TTL)
+
+
+def make_etag(resource: str, version: str) -> str:
+    digest = hashlib.sha256(f"{resource}:{version}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [
+        candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")
+    ]
+    return "*" in candidates or etag in candidates
+
+
+async def cached_json_response(
+    request: Request,
+    *,
+    resource: str,
+    version_key: str,
+    load: Callable[[], Awaitable[BaseModel]],
+) -> Response:
+    """Serve a JSON response from the cache, answering If-None-Match with a 304.
+
+    The version is read before `load` runs, so a body is never stored under a
+    version older than the data it was built from.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        body = (await load()).model_dump_json().encode()
+        return Response(content=body, media_type="application/json")
+
+    version = await get_version(version_key)
+    etag = make_etag(resource, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+
+    body_key = f"response:{resource}:{version}"
+    body = await get_cached_body(body_key)
+    if body is None:
+        body = (await load()).model_dump_json().encode()
+        await set_cached_body(body_key, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -187,6 +187,7 @@ class ChatSnapshot(BaseModel):
 
 class ChatHistoryResponse(BaseModel):
     snapshots: List[ChatSnapshot] = Field(default_factory=list)
+    next_cursor: str | None = None
 
 
 class ChatMessage(BaseModel):
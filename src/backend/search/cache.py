@@ -0,0 +1,166 @@
+import asyncio
+import os
+import time
+import unicodedata
+import uuid
+
+import orjson
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError
+
+from backend.cache import LRUCache, redis_client
+from backend.schemas import SearchResponse
+
+load_dotenv()
+
+
+# Entries are fresh for SEARCH_CACHE_TTL seconds, then served stale while they
+# are refreshed in the background for up to SEARCH_CACHE_STALE_TTL more
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 7200))
+SEARCH_CACHE_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", 86400))
+SEARCH_MEMORY_CACHE_SIZE = int(os.getenv("SEARCH_MEMORY_CACHE_SIZE", 1024))
+SEARCH_LEASE_TTL_MS = int(os.getenv("SEARCH_LEASE_TTL_MS", 10000))
+SEARCH_LEASE_POLL_INTERVAL = 0.05
+
+# Only delete the lease if we still own it, it may have expired and been taken
+RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Sentence punctuation and quotes trimmed from the edges of each token. Symbols
+# that change meaning (c++, c#, $100, 50%) are kept.
+EDGE_PUNCTUATION = "\"'`“”‘’«»()[]{}<>.,;:!?¿¡…*_~"
+
+# Words that don't change what a search returns. Verbs, negations, prepositions
+# and question words are deliberately absent since they change the intent,
+# e.g. "who is" and "who was" the president are different questions.
+STOP_WORDS = {"a", "an", "the", "please"}
+
+
+def normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query).casefold()
+    tokens = [token.strip(EDGE_PUNCTUATION) for token in query.split()]
+    tokens = [token for token in tokens if token]
+
+    # Only drop stop words when enough content is left to identify the query,
+    # so "The Who" doesn't collapse into "who"
+    content_tokens = [token for token in tokens if token not in STOP_WORDS]
+    if len(content_tokens) >= 2:
+        tokens = content_tokens
+
+    return " ".join(tokens)
+
+
+def search_cache_key(query: str, provider: str, num_results: int) -> str:
+    return f"search:{provider}:{num_results}:{normalize_query(query)}"
+
+
+class CachedSearch(BaseModel):
+    response: SearchResponse
+    created_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+    @property
+    def is_stale(self) -> bool:
+        return self.age > SEARCH_CACHE_TTL
+
+    @property
+    def is_expired(self) -> bool:
+        return self.age > SEARCH_CACHE_TTL + SEARCH_CACHE_STALE_TTL
+
+
+memory_cache: LRUCache[str, CachedSearch] = LRUCache(SEARCH_MEMORY_CACHE_SIZE)
+
+
+def encode_cached_search(entry: CachedSearch) -> bytes:
+    return orjson.dumps(entry.model_dump())
+
+
+def decode_cached_search(value: bytes) -> CachedSearch:
+    return CachedSearch.model_validate(orjson.loads(value))
+
+
+async def get_cached_search(key: str) -> CachedSearch | None:
+    """Look up a search in the in-process tier, then Redis. Stale entries are
+    returned too, callers decide whether to refresh them.
+
+    A stale in-process entry is checked against Redis, since another worker may
+    already have refreshed it.
+    """
+    entry = memory_cache.get(key)
+    if entry and entry.is_expired:
+        memory_cache.delete(key)
+        entry = None
+    if entry and not entry.is_stale:
+        return entry
+
+    if not redis_client:
+        return entry
+
+    cached = await redis_client.get(key)
+    if cached is None:
+        return entry
+
+    try:
+        shared = decode_cached_search(cached)
+    except (orjson.JSONDecodeError, ValidationError):
+        # Entries written in an older format are treated as a miss
+        return entry
+
+    if entry and entry.created_at >= shared.created_at:
+        return entry
+    memory_cache.set(key, shared)
+    return shared
+
+
+async def set_cached_search(key: str, response: SearchResponse):
+    entry = CachedSearch(response=response, created_at=time.time())
+    memory_cache.set(key, entry)
+    if redis_client:
+        await redis_client.set(
+            key,
+            encode_cached_search(entry),
+            ex=SEARCH_CACHE_TTL + SEARCH_CACHE_STALE_TTL,
+        )
+
+
+def search_lease_key(key: str) -> str:
+    return f"lease:{key}"
+
+
+async def acquire_search_lease(key: str) -> str | None:
+    """Take a short cross-worker lease on a search. Returns the lease token, or
+    None if another worker is already fetching the same query."""
+    token = uuid.uuid4().hex
+    if not redis_client:
+        return token
+
+    acquired = await redis_client.set(
+        search_lease_key(key), token, nx=True, px=SEARCH_LEASE_TTL_MS
+    )
+    return token if acquired else None
+
+
+async def release_search_lease(key: str, token: str):
+    if redis_client:
+        await redis_client.eval(RELEASE_LEASE_SCRIPT, 1, search_lease_key(key), token)
+
+
+async def wait_for_cached_search(key: str) -> CachedSearch | None:
+    """Wait for the worker holding the lease to cache its results. Gives up when
+    the lease is released or expires without a cached entry."""
+    if not redis_client:
+        return None
+
+    while True:
+        if cached := await get_cached_search(key):
+            return cached
+        if not await redis_client.exists(search_lease_key(key)):
+            return await get_cached_search(key)
+        await asyncio.sleep(SEARCH_LEASE_POLL_INTERVAL)
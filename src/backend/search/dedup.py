@@ -0,0 +1,119 @@
+import hashlib
+import os
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from dotenv import load_dotenv
+
+from backend.schemas import SearchResult
+from backend.search.rerank import tokenize
+
+load_dotenv()
+
+
+# Max differing bits between two SimHashes for results to count as duplicates
+SIMHASH_DISTANCE = int(os.getenv("SIMHASH_DISTANCE", 6))
+# Snippets shorter than this are too small for a meaningful SimHash
+SIMHASH_MIN_TOKENS = int(os.getenv("SIMHASH_MIN_TOKENS", 8))
+SIMHASH_SHINGLE_SIZE = 2
+
+HOST_PREFIXES = ("www.", "m.", "mobile.", "amp.")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "yclid",
+    "igshid",
+    "mc_cid",
+    "mc_eid",
+    "ref_src",
+    "spm",
+    "_ga",
+    "outputtype",
+}
+TRACKING_PARAM_PREFIXES = ("utm_",)
+AMP_PATH_REGEX = re.compile(r"(/amp/?|\.amp)$")
+
+
+def canonicalize_url(url: str) -> str:
+    """Key that's equal for URLs pointing at the same page.
+
+    Drops the scheme, `www.`/mobile/AMP host prefixes, default ports, tracking
+    params, fragments, AMP path suffixes and trailing slashes, and sorts the
+    remaining query params. Only used for comparison, never shown or fetched.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        # Malformed, e.g. a non-numeric port, so only exact copies match
+        return url
+
+    host = (parts.hostname or "").removesuffix(".")
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host.removeprefix(prefix)
+            break
+    if port and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+
+    path = AMP_PATH_REGEX.sub("", parts.path).rstrip("/")
+    params = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS
+        and not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+    )
+    query = f"?{urlencode(params)}" if params else ""
+    return f"{host}{path}{query}"
+
+
+def simhash(tokens: list[str]) -> int:
+    """64-bit SimHash over word shingles."""
+    shingles = [
+        " ".join(tokens[i : i + SIMHASH_SHINGLE_SIZE])
+        for i in range(max(len(tokens) - SIMHASH_SHINGLE_SIZE + 1, 1))
+    ]
+    weights = [0] * 64
+    for shingle in shingles:
+        # blake2b rather than hash() so values are stable across processes
+        value = int.from_bytes(
+            hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big"
+        )
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def dedupe_search_results(search_results: list[SearchResult]) -> list[SearchResult]:
+    """Drop results that are the same page under another URL, or whose title
+    and snippet are near-identical to an earlier result (e.g. syndicated copies).
+    The first, highest ranked, copy is kept."""
+    seen_urls: set[str] = set()
+    seen_hashes: list[int] = []
+    unique_results = []
+    for result in search_results:
+        url = canonicalize_url(result.url)
+        if url in seen_urls:
+            continue
+
+        tokens = tokenize(f"{result.title} {result.content}")
+        if len(tokens) >= SIMHASH_MIN_TOKENS:
+            fingerprint = simhash(tokens)
+            if any(
+                hamming_distance(fingerprint, seen) <= SIMHASH_DISTANCE
+                for seen in seen_hashes
+            ):
+                continue
+            seen_hashes.append(fingerprint)
+
+        seen_urls.add(url)
+        unique_results.append(result)
+    return unique_results
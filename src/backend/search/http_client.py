@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+SEARCH_HTTP2_ENABLED = strtobool(os.getenv("SEARCH_HTTP2_ENABLED", True))
+SEARCH_HTTP_MAX_CONNECTIONS = int(os.getenv("SEARCH_HTTP_MAX_CONNECTIONS", 100))
+SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+SEARCH_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("SEARCH_HTTP_KEEPALIVE_EXPIRY", 30))
+SEARCH_HTTP_TIMEOUT = float(os.getenv("SEARCH_HTTP_TIMEOUT", 10))
+
+
+# One long-lived client per provider. Each provider only talks to a single host,
+# so the client's connection limits are effectively that host's pool size.
+_http_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=SEARCH_HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=SEARCH_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SEARCH_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=SEARCH_HTTP_TIMEOUT,
+    )
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    client = _http_clients.get(name)
+    if client is None or client.is_closed:
+        client = create_http_client()
+        _http_clients[name] = client
+    return client
+
+
+async def close_http_clients():
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    await asyncio.gather(*(client.aclose() for client in clients))
@@ -4,6 +4,8 @@ from backend.schemas import SearchResponse
 
 
 class SearchProvider(ABC):
+    num_results: int = 6
+
     @abstractmethod
     async def search(self, query: str) -> SearchResponse:
         pass
@@ -7,7 +7,8 @@ from backend.search.providers.base import SearchProvider
 
 
 class BingSearchProvider(SearchProvider):
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client: httpx.AsyncClient):
+        self.client = client
         self.host = "https://api.bing.microsoft.com/v7.0"
         self.headers = {
             "Ocp-Apim-Subscription-Key": api_key,
@@ -15,11 +16,10 @@ class BingSearchProvider(SearchProvider):
         }
 
     async def search(self, query: str) -> SearchResponse:
-        async with httpx.AsyncClient() as client:
-            link_results, image_results = await asyncio.gather(
-                self.get_link_results(client, query),
-                self.get_image_results(client, query),
-            )
+        link_results, image_results = await asyncio.gather(
+            self.get_link_results(self.client, query, self.num_results),
+            self.get_image_results(self.client, query),
+        )
 
         return SearchResponse(results=link_results, images=image_results)
 
@@ -7,15 +7,15 @@ from backend.search.providers.base import SearchProvider
 
 
 class SearxngSearchProvider(SearchProvider):
-    def __init__(self, host: str):
+    def __init__(self, host: str, client: httpx.AsyncClient):
         self.host = host
+        self.client = client
 
     async def search(self, query: str) -> SearchResponse:
-        async with httpx.AsyncClient() as client:
-            link_results, image_results = await asyncio.gather(
-                self.get_link_results(client, query),
-                self.get_image_results(client, query),
-            )
+        link_results, image_results = await asyncio.gather(
+            self.get_link_results(self.client, query, self.num_results),
+            self.get_image_results(self.client, query),
+        )
 
         return SearchResponse(results=link_results, images=image_results)
 
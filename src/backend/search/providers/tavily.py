@@ -1,31 +1,38 @@
-from tavily import TavilyClient
+import httpx
 
 from backend.schemas import SearchResponse, SearchResult
 from backend.search.providers.base import SearchProvider
 
 
 class TavilySearchProvider(SearchProvider):
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client: httpx.AsyncClient):
         self.api_key = api_key
-        self.tavily = TavilyClient(api_key=self.api_key)
+        self.client = client
+        self.host = "https://api.tavily.com"
 
     async def search(self, query: str) -> SearchResponse:
-        response = self.tavily.search(
-            query=query,
-            search_depth="basic",
-            max_results=6,
-            include_images=True,
+        response = await self.client.post(
+            f"{self.host}/search",
+            json={
+                "api_key": self.api_key,
+                "query": query,
+                "search_depth": "basic",
+                "max_results": self.num_results,
+                "include_images": True,
+            },
         )
+        response.raise_for_status()
+        results = response.json()
 
-        if response is None:
-            raise ValueError("No response from Tavily")
+        if "results" not in results:
+            raise ValueError("No results in the Tavily response")
 
-        results = [
+        search_results = [
             SearchResult(
                 title=result["title"],
                 url=result["url"],
                 content=result["content"],
             )
-            for result in response["results"]
+            for result in results["results"]
         ]
-        return SearchResponse(results=results, images=response["images"])
+        return SearchResponse(results=search_results, images=results["images"])
@@ -0,0 +1,74 @@
+import math
+import os
+import re
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from backend.schemas import SearchResult
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+RERANK_ENABLED = strtobool(os.getenv("RERANK_ENABLED", True))
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Titles are short and usually on topic, so their terms count extra
+BM25_TITLE_WEIGHT = int(os.getenv("BM25_TITLE_WEIGHT", 2))
+
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_REGEX.findall(text.casefold())
+
+
+def bm25_scores(query: str, documents: list[list[str]]) -> list[float]:
+    """Okapi BM25 of each tokenized document against the query, with document
+    frequencies taken from the candidates themselves."""
+    if not documents:
+        return []
+
+    query_terms = set(tokenize(query))
+    avg_length = sum(len(document) for document in documents) / len(documents) or 1
+    term_counts = [Counter(document) for document in documents]
+    document_frequency = Counter(
+        term for counts in term_counts for term in counts.keys() & query_terms
+    )
+    idf = {
+        term: math.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+        for term, frequency in document_frequency.items()
+    }
+
+    scores = []
+    for document, counts in zip(documents, term_counts):
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(document) / avg_length)
+        scores.append(
+            sum(
+                weight * counts[term] * (BM25_K1 + 1) / (counts[term] + length_norm)
+                for term, weight in idf.items()
+                if counts[term]
+            )
+        )
+    return scores
+
+
+def rerank_search_results(
+    query: str, search_results: list[SearchResult]
+) -> list[SearchResult]:
+    """Order results by BM25 relevance to the query over title and snippet.
+
+    The sort is stable, so ties (including results sharing no terms with the
+    query) keep the provider's order.
+    """
+    if not RERANK_ENABLED or len(search_results) < 2:
+        return search_results
+
+    documents = [
+        tokenize(result.title) * BM25_TITLE_WEIGHT + tokenize(result.content)
+        for result in search_results
+    ]
+    scores = bm25_scores(query, documents)
+    order = sorted(range(len(search_results)), key=lambda i: -scores[i])
+    return [search_results[i] for i in order]
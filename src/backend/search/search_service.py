@@ -1,11 +1,19 @@
-import json
+import asyncio
 import os
 
-import redis
 from dotenv import load_dotenv
 from fastapi import HTTPException
 
 from backend.schemas import SearchResponse
+from backend.search.cache import (
+    acquire_search_lease,
+    get_cached_search,
+    release_search_lease,
+    search_cache_key,
+    set_cached_search,
+    wait_for_cached_search,
+)
+from backend.search.http_client import get_http_client
 from backend.search.providers.base import SearchProvider
 from backend.search.providers.bing import BingSearchProvider
 from backend.search.providers.searxng import SearxngSearchProvider
@@ -15,8 +23,7 @@ from backend.search.providers.tavily import TavilySearchProvider
 load_dotenv()
 
 
-redis_url = os.getenv("REDIS_URL")
-redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+SEARCH_PROVIDER = os.getenv("SEARCH_PROVIDER", "searxng")
 
 
 def get_searxng_base_url():
@@ -59,22 +66,26 @@ def get_bing_api_key():
     return bing_api_key
 
 
-def get_search_provider() -> SearchProvider:
-    search_provider = os.getenv("SEARCH_PROVIDER", "searxng")
-
+def create_search_provider(search_provider: str) -> SearchProvider:
     match search_provider:
         case "searxng":
             searxng_base_url = get_searxng_base_url()
-            return SearxngSearchProvider(searxng_base_url)
+            return SearxngSearchProvider(
+                searxng_base_url, get_http_client(search_provider)
+            )
         case "tavily":
             tavily_api_key = get_tavily_api_key()
-            return TavilySearchProvider(tavily_api_key)
+            return TavilySearchProvider(
+                tavily_api_key, get_http_client(search_provider)
+            )
         case "serper":
             serper_api_key = get_serper_api_key()
-            return SerperSearchProvider(serper_api_key)
+            return SerperSearchProvider(
+                serper_api_key, get_http_client(search_provider)
+            )
         case "bing":
             bing_api_key = get_bing_api_key()
-            return BingSearchProvider(bing_api_key)
+            return BingSearchProvider(bing_api_key, get_http_client(search_provider))
         case _:
             raise HTTPException(
                 status_code=500,
@@ -82,21 +93,87 @@ def get_search_provider() -> SearchProvider:
             )
 
 
-async def perform_search(query: str) -> SearchResponse:
-    search_provider = get_search_provider()
+# Provider instances are built once and reused across requests, keyed by name
+_search_providers: dict[str, SearchProvider] = {}
+
+
+def init_search_provider() -> SearchProvider:
+    """Resolve and validate the configured provider. Called once at startup so
+    configuration errors fail the boot instead of the first user request."""
+    if SEARCH_PROVIDER not in _search_providers:
+        _search_providers[SEARCH_PROVIDER] = create_search_provider(SEARCH_PROVIDER)
+    return _search_providers[SEARCH_PROVIDER]
+
+
+def get_search_provider() -> SearchProvider:
+    return _search_providers.get(SEARCH_PROVIDER) or init_search_provider()
+
+
+# Searches currently being fetched by this worker, keyed by cache key
+_inflight_searches: dict[str, asyncio.Task[SearchResponse]] = {}
+
+
+async def fetch_search_results(
+    search_provider: SearchProvider, query: str, cache_key: str
+) -> SearchResponse:
+    lease = await acquire_search_lease(cache_key)
+    if lease is None:
+        # Another worker is already fetching this query, reuse its results
+        if cached := await wait_for_cached_search(cache_key):
+            return cached.response
 
     try:
-        cache_key = f"search:{query}"
-        if redis_client and (cached_results := redis_client.get(cache_key)):
-            cached_json = json.loads(json.loads(cached_results.decode("utf-8")))  # type: ignore
-            return SearchResponse(**cached_json)
+        # Another worker may have cached the query and released its lease
+        # between our cache read and taking the lease
+        if lease is not None:
+            cached = await get_cached_search(cache_key)
+            if cached and not cached.is_stale:
+                return cached.response
 
         results = await search_provider.search(query)
+        await set_cached_search(cache_key, results)
+        return results
+    finally:
+        if lease is not None:
+            await release_search_lease(cache_key, lease)
 
-        if redis_client:
-            redis_client.set(cache_key, json.dumps(results.model_dump_json()), ex=7200)
 
-        return results
+def coalesce_search(
+    search_provider: SearchProvider, query: str, cache_key: str
+) -> asyncio.Task[SearchResponse]:
+    """Share one provider call between concurrent identical searches."""
+    if task := _inflight_searches.get(cache_key):
+        return task
+
+    task = asyncio.create_task(fetch_search_results(search_provider, query, cache_key))
+    _inflight_searches[cache_key] = task
+
+    def on_done(task: asyncio.Task[SearchResponse]):
+        _inflight_searches.pop(cache_key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter went away
+            task.exception()
+
+    task.add_done_callback(on_done)
+    return task
+
+
+async def perform_search(query: str) -> SearchResponse:
+    search_provider = get_search_provider()
+
+    try:
+        cache_key = search_cache_key(
+            query, SEARCH_PROVIDER, search_provider.num_results
+        )
+        if cached := await get_cached_search(cache_key):
+            if cached.is_stale:
+                # Serve the stale results now and refresh them in the background
+                coalesce_search(search_provider, query, cache_key)
+            return cached.response
+
+        # Shield the shared task so one disconnecting client doesn't cancel it
+        # for everyone else waiting on the same query
+        return await asyncio.shield(coalesce_search(search_provider, query, cache_key))
     except Exception:
         raise HTTPException(
             status_code=500, detail="There was an error while searching."
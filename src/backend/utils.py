@@ -21,3 +21,7 @@ def strtobool(val: str | bool) -> bool:
 
 DB_ENABLED = strtobool(os.environ.get("DB_ENABLED", "true"))
 PRO_MODE_ENABLED = strtobool(os.environ.get("PRO_MODE_ENABLED", "true"))
+PRO_SEARCH_SPECULATIVE = strtobool(os.environ.get("PRO_SEARCH_SPECULATIVE", "false"))
+OPTIMISTIC_SEARCH_ENABLED = strtobool(
+    os.environ.get("OPTIMISTIC_SEARCH_ENABLED", "false")
+)
@@ -52,6 +52,7 @@ export type BeginStream = {
 
 export type ChatHistoryResponse = {
   snapshots?: Array<ChatSnapshot>;
+  next_cursor?: string | null;
 };
 
 export type ChatMessage = {
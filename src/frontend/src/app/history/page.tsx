@@ -2,13 +2,15 @@
 
 import { ErrorMessage } from "@/components/assistant-message";
 import RecentChat from "@/components/recent-chat";
+import { Button } from "@/components/ui/button";
 import { Separator } from "@/components/ui/separator";
 import { useChatHistory } from "@/hooks/history";
 import { HistoryIcon } from "lucide-react";
 import React from "react";
 
 export default function RecentsPage() {
-  const { data: chats, isLoading, error } = useChatHistory();
+  const { chats, error, fetchNextPage, hasNextPage, isFetchingNextPage } =
+    useChatHistory();
 
   if (!error && !chats) return <div>Loading...</div>;
 
@@ -31,6 +33,18 @@ export default function RecentsPage() {
             ))}
           </ul>
         )}
+        {hasNextPage && (
+          <div className="flex justify-center mt-6">
+            <Button
+              variant="secondary"
+              size="sm"
+              onClick={() => fetchNextPage()}
+              disabled={isFetchingNextPage}
+            >
+              {isFetchingNextPage ? "Loading..." : "Load more"}
+            </Button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -146,10 +146,6 @@ export const useChat = () => {
           eventItem.data as AgentSearchQueriesStream;
         steps_details[queryStepNumber].queries = queries;
         steps_details[queryStepNumber].status = AgentSearchStepStatus.CURRENT;
-        if (queryStepNumber !== 0) {
-          steps_details[queryStepNumber - 1].status =
-            AgentSearchStepStatus.DONE;
-        }
         state.agent_response = {
           steps_details: steps_details,
         };
@@ -157,8 +153,13 @@ export const useChat = () => {
       case StreamEvent.AGENT_READ_RESULTS:
         const { results, step_number: resultsStepNumber } =
           eventItem.data as AgentReadResultsStream;
+        // Independent steps run concurrently, so each step is marked done
+        // when its own results arrive
         steps_details[resultsStepNumber].results = results;
-
+        steps_details[resultsStepNumber].status = AgentSearchStepStatus.DONE;
+        state.agent_response = {
+          steps_details: steps_details,
+        };
         break;
       case StreamEvent.AGENT_FINISH:
         break;
@@ -1,23 +1,42 @@
-import { useQuery } from "@tanstack/react-query";
+import { InfiniteData, useInfiniteQuery } from "@tanstack/react-query";
 import { env } from "@/env.mjs";
-import { ChatSnapshot } from "../../generated";
+import { ChatHistoryResponse } from "../../generated";
 
 const BASE_URL = env.NEXT_PUBLIC_API_URL;
 
-export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
-  const response = await fetch(`${BASE_URL}/history`);
+const HISTORY_PAGE_SIZE = 50;
+
+export const fetchChatHistory = async (
+  cursor: string | null,
+): Promise<ChatHistoryResponse> => {
+  const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE) });
+  if (cursor) {
+    params.set("cursor", cursor);
+  }
+  const response = await fetch(`${BASE_URL}/history?${params}`);
   if (!response.ok) {
     const errorData = await response.json();
     throw new Error(errorData.detail || "Failed to fetch chat history");
   }
-  const data = await response.json();
-  return data.snapshots;
+  return await response.json();
 };
 
 export const useChatHistory = () => {
-  return useQuery<ChatSnapshot[], Error>({
-    queryKey: ["chatHistory"],
-    queryFn: fetchChatHistory,
-    retry: false,
-  });
+  const { data, error, fetchNextPage, hasNextPage, isFetchingNextPage } =
+    useInfiniteQuery<
+      ChatHistoryResponse,
+      Error,
+      InfiniteData<ChatHistoryResponse>,
+      string[],
+      string | null
+    >({
+      queryKey: ["chatHistory"],
+      queryFn: ({ pageParam }) => fetchChatHistory(pageParam),
+      initialPageParam: null,
+      getNextPageParam: (lastPage) => lastPage.next_cursor ?? undefined,
+      retry: false,
+    });
+
+  const chats = data?.pages.flatMap((page) => page.snapshots ?? []);
+  return { chats, error, fetchNextPage, hasNextPage, isFetchingNextPage };
 };